@@ -8,12 +8,17 @@ The value eval function is build by assigning a penalty depending on how much do
 
 """
 
+from functools import lru_cache
+
 import numpy as np
-from scipy.interpolate import RegularGridInterpolator
 from scipy.stats import gamma, truncnorm
 
 # right now once 90 is hit it doesnt seem to matter how much is overdosed. somehow this must be fixed
 
+# floating point type of the values and policy tables (and the BED tables and
+# probabilities they are computed from). set to np.float64 for full precision
+_DTYPE = np.float32
+
 
 def data_fit(data):
     """
@@ -69,19 +74,44 @@ def probdist(X):
 
     Returns
     -------
-    prob : list
-        list with probabilities for each sparing factor.
+    prob : array
+        array with probabilities for each sparing factor.
+
+    """
+    sample_sf = np.arange(0.01, 1.71, 0.01)
+    # both bin edges are evaluated in a single cdf call
+    cdf = X.cdf(np.concatenate((sample_sf + 0.005, sample_sf - 0.005)))
+    prob = cdf[: len(sample_sf)] - cdf[len(sample_sf) :]
+    return prob
+
+
+@lru_cache(maxsize=1024)
+def _sf_probabilities(mean, standard_deviation):
+    """
+    probabilities of the sparing factors for the truncated normal distribution
+    used in value_eval. The probabilities are cached for each (mean, std)
+    pair, e.g. when the same fraction is recalculated in the GUI.
+
+    Parameters
+    ----------
+    mean : float
+        mean of the sparing factor distribution.
+    standard_deviation : float
+        standard deviation of the sparing factor distribution.
+
+    Returns
+    -------
+    prob : array
+        read-only array with probabilities for each sparing factor.
 
     """
-    prob = np.zeros(170)
-    idx = 0
-    for i in np.arange(0.01, 1.71, 0.01):
-        prob[idx] = X.cdf(i + 0.004999999999999999999) - X.cdf(i - 0.005)
-        idx += 1
+    X = get_truncated_normal(mean=mean, sd=standard_deviation, low=0, upp=1.3)
+    prob = probdist(X)
+    prob.setflags(write=False)
     return prob
 
 
-def std_calc(measured_data, alpha, beta):
+def std_calc(measured_data, alpha, beta, variance=None):
     """
     calculates the most likely standard deviation for a list of k sparing factors and a gamma prior
     measured_data: list/array with k sparing factors
@@ -94,6 +124,8 @@ def std_calc(measured_data, alpha, beta):
         shape of gamma distribution
     beta : float
         scale of gamma distrinbution
+    variance : float, optional
+        precomputed variance of measured_data. Calculated from measured_data if not given.
 
     Returns
     -------
@@ -102,16 +134,16 @@ def std_calc(measured_data, alpha, beta):
 
     """
     n = len(measured_data)
+    if variance is None:
+        variance = np.var(measured_data)
     std_values = np.arange(0.00001, 0.5, 0.00001)
-    likelihood_values = np.zeros(len(std_values))
-    for index, value in enumerate(std_values):
-        likelihood_values[index] = (
-            value ** (alpha - 1)
-            / value ** (n - 1)
-            * np.exp(-1 / beta * value)
-            * np.exp(-np.var(measured_data) / (2 * (value**2 / n)))
-        )
-    std = std_values[np.argmax(likelihood_values)]
+    # the likelihood is evaluated in log space to avoid underflow
+    log_likelihood_values = (
+        (alpha - n) * np.log(std_values)
+        - std_values / beta
+        - n * variance / (2 * std_values**2)
+    )
+    std = std_values[np.argmax(log_likelihood_values)]
     return std
 
 
@@ -125,7 +157,7 @@ def argfind(searched_list, value):
     Parameters
     ----------
     searched_list : list/array
-        list in which our searched value is.
+        ascending list in which our searched value is.
     value : float
         item inside list.
 
@@ -135,7 +167,14 @@ def argfind(searched_list, value):
         index of value inside list.
 
     """
-    index = min(range(len(searched_list)), key=lambda i: abs(searched_list[i] - value))
+    # searched_list is sorted, so a binary search gives the
+    # insertion point and the nearest value is one of its neighbours
+    index = int(np.searchsorted(searched_list, value))
+    if index > 0 and (
+        index == len(searched_list)
+        or abs(searched_list[index - 1] - value) <= abs(searched_list[index] - value)
+    ):
+        index -= 1
     return index
 
 
@@ -158,7 +197,8 @@ def BED_calc0(dose, ab, sparing=1):
         BED to be delivered based on dose, sparing factor and alpha-beta ratio.
 
     """
-    BED = sparing * dose * (1 + (sparing * dose) / ab)
+    sparing_dose = sparing * dose
+    BED = sparing_dose * (1 + sparing_dose / ab)
     return BED
 
 
@@ -181,12 +221,279 @@ def BED_calc_matrix(actionspace, ab, sf):
         list of all future BEDs based on the delivered doses and sparing factors.
 
     """
-    BED = np.outer(sf, actionspace) * (
-        1 + np.outer(sf, actionspace) / ab
-    )  # produces a sparing factors x actions space array
+    sf_dose = np.outer(sf, actionspace)  # sparing factors x actions space array
+    BED = sf_dose * (1 + sf_dose / ab)
     return BED
 
 
+def _bed_states(BED, bound):
+    """
+    creates the BED states in steps of 1 from the accumulated BED up to
+    the bound, followed by the bound and the upper bound (bound + 1).
+
+    Parameters
+    ----------
+    BED : float
+        accumulated BED.
+    bound : float
+        maximal (OAR) or prescribed (tumor) BED.
+
+    Returns
+    -------
+    states : array
+        BED states.
+
+    """
+    n_steps = max(int(np.ceil(bound - BED)), 0)
+    states = np.empty(n_steps + 2)
+    states[:n_steps] = np.arange(n_steps)
+    states[:n_steps] += BED
+    states[-2] = bound
+    states[-1] = bound + 1
+    return states
+
+
+@lru_cache(maxsize=32)
+def _bed_tables(min_dose, max_dose, abn, abt, sf_bytes, dtype):
+    """
+    calculates the actionspace and the BED tables relating each action to
+    the OAR and tumor dose. The tables only depend on the arguments, which
+    stay the same over the fractions of a plan, so they are cached and
+    returned as read-only arrays.
+
+    Parameters
+    ----------
+    min_dose : float
+        minimal physical dose to be delivered in one fraction.
+    max_dose : float
+        maximal physical dose to be delivered in one fraction.
+    abn : float
+        alpha-beta ratio of OAR.
+    abt : float
+        alpha-beta ratio of tumor.
+    sf_bytes : bytes
+        sparing factors as raw float64 buffer (sf.tobytes()).
+    dtype : type
+        floating point type of OAR_dose and tumor_dose, e.g. _DTYPE.
+
+    Returns
+    -------
+    list
+        actionspace, OAR_dose with dimension sf:actionspace
+        and tumor_dose with dimension actionspace.
+
+    """
+    sf = np.frombuffer(sf_bytes)
+    # the actions are min_dose + i * 0.1 Gy for integer i, the number of
+    # actions is that of np.arange(min_dose, max_dose + 0.1, 0.1)
+    n_action = int(np.ceil((max_dose + 0.1 - min_dose) / 0.1))
+    actionspace = min_dose + np.arange(n_action) * 0.1
+    OAR_dose = BED_calc_matrix(
+        actionspace, abn, sf
+    )  # calculates the dose that is deposited into the normal tissue for all sparing factors
+    tumor_dose = BED_calc_matrix(actionspace, abt, 1)[
+        0
+    ]  # this is the dose delivered to the tumor
+    OAR_dose = OAR_dose.astype(dtype)
+    tumor_dose = tumor_dose.astype(dtype)
+    for table in (actionspace, OAR_dose, tumor_dose):
+        table.setflags(write=False)
+    return [actionspace, OAR_dose, tumor_dose]
+
+
+def grid_weights(grid, query, stepsize=1):
+    """
+    lower grid index and linear interpolation weight of each query point
+    on a grid that is spaced uniformly by stepsize apart from its two upper
+    bound points. The grid cell is found by subtracting and flooring.
+
+    Parameters
+    ----------
+    grid : array
+        ascending BED grid.
+    query : float/array
+        BED at which is interpolated, must lie inside the grid.
+    stepsize : float, optional
+        spacing of the BED grid. The default is 1.
+
+    Returns
+    -------
+    list
+        index of the lower grid point and weight of the upper grid point,
+        both with the shape of query.
+
+    """
+    index = np.clip(((query - grid[0]) / stepsize).astype(np.intp), 0, len(grid) - 2)
+    weight = (query - grid[index]) / (grid[index + 1] - grid[index])
+    return [index, weight]
+
+
+def interp_bilinear_weighted(values, index_t, weight_t, index_n, weight_n):
+    """
+    bilinear interpolation of values from the grid indices and weights
+    of grid_weights. The four grid corners are read from the flattened
+    values. The tumor and OAR parts are broadcast against each other.
+
+    Parameters
+    ----------
+    values : array
+        2d array with dimension tumor grid:OAR grid.
+    index_t, weight_t : array
+        lower tumor grid index and weight.
+    index_n, weight_n : array
+        lower OAR grid index and weight.
+
+    Returns
+    -------
+    interpolated : array
+        interpolated values with the broadcast shape of the indices.
+
+    """
+    n_columns = values.shape[1]
+    flat_values = values.ravel()
+    flat_index = index_t * n_columns + index_n
+    # interpolate along the OAR grid in the lower and upper tumor row
+    lower = flat_values.take(flat_index)
+    lower = lower + weight_n * (flat_values.take(flat_index + 1) - lower)
+    upper = flat_values.take(flat_index + n_columns)
+    upper = upper + weight_n * (flat_values.take(flat_index + n_columns + 1) - upper)
+    # and then along the tumor grid
+    upper -= lower
+    upper *= weight_t
+    upper += lower
+    return upper
+
+
+def interp_bilinear(grid_t, grid_n, values, query_t, query_n, stepsize=1):
+    """
+    bilinear interpolation of values on the BED grid (grid_t, grid_n).
+    All query points are evaluated in one vectorized call. Both grids are
+    spaced uniformly by stepsize apart from the two upper bound points, so
+    the grid cell is found by subtracting and flooring (see grid_weights).
+    query_t and query_n are broadcast against each other and must lie
+    inside the grid.
+
+    Parameters
+    ----------
+    grid_t : array
+        ascending tumor BED grid (first axis of values).
+    grid_n : array
+        ascending OAR BED grid (second axis of values).
+    values : array
+        2d array with dimension len(grid_t):len(grid_n).
+    query_t : float/array
+        tumor BED at which values are interpolated.
+    query_n : float/array
+        OAR BED at which values are interpolated.
+    stepsize : float, optional
+        spacing of the BED grids. The default is 1.
+
+    Returns
+    -------
+    interpolated : array
+        interpolated values with the broadcast shape of query_t and query_n.
+
+    """
+    index_t, weight_t = grid_weights(grid_t, query_t, stepsize)
+    index_n, weight_n = grid_weights(grid_n, query_n, stepsize)
+    return interp_bilinear_weighted(values, index_t, weight_t, index_n, weight_n)
+
+
+def _backward_step(
+    Values_prev,
+    prob,
+    BEDT,
+    BEDNT,
+    actionspace,
+    OAR_dose,
+    tumor_dose,
+    bound_OAR,
+    bound_tumor,
+    upperbound_tumor,
+    upperbound_normal_tissue,
+):
+    """
+    one backward induction step of value_eval for a fraction state that is
+    neither the actual nor the last fraction.
+
+    Parameters
+    ----------
+    Values_prev : array
+        values of the following fraction state with dimension BEDT:BEDNT:sf.
+    prob : array
+        probability of each sparing factor.
+    BEDT : array
+        tumor BED states.
+    BEDNT : array
+        OAR BED states.
+    actionspace : array
+        physical doses that can be delivered.
+    OAR_dose : array
+        OAR BED for each sparing factor and action, dimension sf:actionspace.
+    tumor_dose : array
+        tumor BED for each action.
+    bound_OAR : float
+        maximal BED of OAR.
+    bound_tumor : float
+        prescribed tumor BED.
+    upperbound_tumor : float
+        tumor BED assigned to states surpassing bound_tumor.
+    upperbound_normal_tissue : float
+        OAR BED assigned to states surpassing bound_OAR.
+
+    Returns
+    -------
+    list
+        Values_cur and policy_cur (optimal physical dose)
+        with dimension BEDT:BEDNT:sf.
+
+    """
+    Values_cur = np.zeros(Values_prev.shape, dtype=Values_prev.dtype)
+    policy_cur = np.zeros(Values_prev.shape, dtype=Values_prev.dtype)
+    future_values_prob = np.einsum(
+        "tns,s->tn", Values_prev, prob, optimize=True
+    )  # future values of tumor and oar state
+    # all states are broadcast at once, dim(future_tumor)=(BEDT,actionspace)
+    # and dim(future_OAR)=(BEDNT,sf,actionspace)
+    future_tumor = BEDT.reshape(len(BEDT), 1) + tumor_dose
+    future_tumor[
+        future_tumor > bound_tumor
+    ] = upperbound_tumor  # any dose surpassing the tumor bound is set to tumor_bound + 1
+    future_OAR = BEDNT.reshape(len(BEDNT), 1, 1) + OAR_dose
+    overdosing = (future_OAR - bound_OAR).clip(min=0)
+    future_OAR[
+        future_OAR > bound_OAR
+    ] = upperbound_normal_tissue  # any dose surpassing the OAR bound is set to OAR_bound + 1
+    penalties = (
+        overdosing * -10000000000
+    )  # additional penalty when overdosing is needed when choosing a minimum dose to be delivered
+    # the grid indices and weights do not depend on the block
+    index_t, weight_t = grid_weights(BEDT, future_tumor)
+    index_n, weight_n = grid_weights(BEDNT, future_OAR)
+    # the tumor states are processed in blocks of at least one state, the
+    # BEDT:BEDNT:sf:actionspace temporaries hold about 2**20 elements
+    # or future_OAR.size elements if that is larger
+    block_size = max(1, 2**20 // future_OAR.size)
+    for block_start in range(0, len(BEDT), block_size):
+        block = slice(block_start, block_start + block_size)
+        future_value = interp_bilinear_weighted(
+            future_values_prob,
+            index_t[block, np.newaxis, np.newaxis, :],
+            weight_t[block, np.newaxis, np.newaxis, :],
+            index_n,
+            weight_n,
+        )
+        # Vs is built in place in the interpolation result, the values
+        # are gathered at the argmax along the actionspace
+        Vs = future_value
+        Vs -= OAR_dose
+        Vs += penalties
+        best_index = Vs.argmax(axis=3)
+        policy_cur[block] = actionspace[best_index]
+        Values_cur[block] = np.take_along_axis(Vs, best_index[..., np.newaxis], axis=3)[..., 0]
+    return [Values_cur, policy_cur]
+
+
 def value_eval(
     fraction,
     number_of_fractions,
@@ -204,6 +511,8 @@ def value_eval(
     fixed_prob=0,
     fixed_mean=0,
     fixed_std=0,
+    sf_mean=None,
+    sf_variance=None,
 ):
     """
     Calculates the optimal dose for the desired fraction.
@@ -244,6 +553,10 @@ def value_eval(
         mean of the fixed sparing factor normal distribution
     std_fixed: float
         standard deviation of the fixed sparing factor normal distribution
+    sf_mean: float, optional
+        precomputed mean of sparing_factors. Calculated from sparing_factors if not given
+    sf_variance: float, optional
+        precomputed variance of sparing_factors. Calculated from sparing_factors if not given
     Returns
     -------
     list
@@ -257,25 +570,22 @@ def value_eval(
     """
 
     if fixed_prob != 1:
-        mean = np.mean(
-            sparing_factors
-        )  # extract the mean and std to setup the sparingfactor distribution
-        standard_deviation = std_calc(sparing_factors, alpha, beta)
+        # extract the mean and std to setup the sparingfactor distribution
+        mean = np.mean(sparing_factors) if sf_mean is None else sf_mean
+        standard_deviation = std_calc(sparing_factors, alpha, beta, sf_variance)
     if fixed_prob == 1:
         mean = fixed_mean
         standard_deviation = fixed_std
-    X = get_truncated_normal(mean=mean, sd=standard_deviation, low=0, upp=1.3)
-    prob = np.array(probdist(X))
+    prob = _sf_probabilities(float(mean), float(standard_deviation))
     sf = np.arange(0.01, 1.71, 0.01)
     sf = sf[prob > 0.00001]  # get rid of all probabilities below 10^-5
-    prob = prob[prob > 0.00001]
+    prob = prob[prob > 0.00001].astype(_DTYPE)
     underdosepenalty = 10
-    BEDT = np.arange(BED_tumor, bound_tumor, 1)  # tumordose
-    BEDNT = np.arange(BED_OAR, bound_OAR, 1)  # OAR dose
-    BEDNT = np.concatenate((BEDNT, [bound_OAR, bound_OAR + 1]))
-    BEDT = np.concatenate((BEDT, [bound_tumor, bound_tumor + 1]))
+    BEDT = _bed_states(BED_tumor, bound_tumor)  # tumordose
+    BEDNT = _bed_states(BED_OAR, bound_OAR)  # OAR dose
     Values = np.zeros(
-        [(number_of_fractions - fraction), len(BEDT), len(BEDNT), len(sf)]
+        [(number_of_fractions - fraction), len(BEDT), len(BEDNT), len(sf)],
+        dtype=_DTYPE,
     )  # 2d values list with first indice being the BED and second being the sf
     if max_dose > (-1 + np.sqrt(1 + 4 * 1 * (bound_tumor) / abt)) / (
         2 * 1**2 / abt
@@ -283,19 +593,16 @@ def value_eval(
         max_dose = (-1 + np.sqrt(1 + 4 * 1 * (bound_tumor) / abt)) / (2 * 1**2 / abt)
     if min_dose > max_dose:
         min_dose = max_dose - 0.1
-    actionspace = np.arange(min_dose, max_dose + 0.1, 0.1)
+    [actionspace, OAR_dose, tumor_dose] = _bed_tables(
+        min_dose, max_dose, abn, abt, sf.tobytes(), _DTYPE
+    )  # OAR dose for all sparing factors and tumor dose of each action
     policy = np.zeros(
-        ((number_of_fractions - fraction), len(BEDT), len(BEDNT), len(sf))
+        ((number_of_fractions - fraction), len(BEDT), len(BEDNT), len(sf)),
+        dtype=_DTYPE,
     )
     upperbound_normal_tissue = bound_OAR + 1
     upperbound_tumor = bound_tumor + 1
 
-    OAR_dose = BED_calc_matrix(
-        actionspace, abn, sf
-    )  # calculates the dose that is deposited into the normal tissue for all sparing factors
-    tumor_dose = BED_calc_matrix(actionspace, abt, 1)[
-        0
-    ]  # this is the dose delivered to the tumor
     actual_fraction_sf = argfind(sf, np.round(sparing_factors[-1], 2))
 
     for index, frac_state_plus in enumerate(
@@ -311,17 +618,14 @@ def value_eval(
                 future_OAR > bound_OAR
             ] = upperbound_normal_tissue  # any dose surpassing the upper bound will be set to the upper bound which will be penalized strongly
             future_tumor[future_tumor > bound_tumor] = upperbound_tumor
-            future_values_prob = (Values[index - 1] * prob).sum(
-                axis=2
+            future_values_prob = np.einsum(
+                "tns,s->tn", Values[index - 1], prob, optimize=True
             )  # future values of tumor and oar state
-            value_interpolation = RegularGridInterpolator(
-                (BEDT, BEDNT), future_values_prob
-            )
-            future_value_actual = value_interpolation(
-                np.array([future_tumor, future_OAR]).T
+            future_value_actual = interp_bilinear(
+                BEDT, BEDNT, future_values_prob, future_tumor, future_OAR
             )
             Vs = future_value_actual - OAR_dose[actual_fraction_sf]
-            actual_policy = Vs.argmax(axis=0)
+            actual_policy = actionspace[Vs.argmax(axis=0)]
 
         elif (
             frac_state == fraction
@@ -334,20 +638,17 @@ def value_eval(
                 ] = upperbound_normal_tissue  # any dose surpassing the upper bound will be set to the upper bound which will be penalized strongly
                 future_tumor = BED_tumor + tumor_dose
                 future_tumor[future_tumor > bound_tumor] = upperbound_tumor
-                future_values_prob = (Values[index - 1] * prob).sum(
-                    axis=2
+                future_values_prob = np.einsum(
+                    "tns,s->tn", Values[index - 1], prob, optimize=True
                 )  # future values of tumor and oar state
-                value_interpolation = RegularGridInterpolator(
-                    (BEDT, BEDNT), future_values_prob
-                )
                 penalties = (
                     overdosing * -10000000000
                 )  # additional penalty when overdosing is needed when choosing a minimum dose to be delivered
-                future_value_actual = value_interpolation(
-                    np.array([future_tumor, future_OAR]).T
+                future_value_actual = interp_bilinear(
+                    BEDT, BEDNT, future_values_prob, future_tumor, future_OAR
                 )
                 Vs = future_value_actual - OAR_dose[actual_fraction_sf] + penalties
-                actual_policy = Vs.argmax(axis=0)
+                actual_policy = actionspace[Vs.argmax(axis=0)]
             else:
                 sf_end = sparing_factors[-1]
                 best_action_BED = (
@@ -369,108 +670,83 @@ def value_eval(
 
                 future_tumor = BED_tumor + BED_calc0(best_action, abt)
                 future_OAR = BED_OAR + BED_calc0(best_action, abn, sf_end)
-                actual_policy = best_action * 10
-        else:
-            future_values_prob = (Values[index - 1] * prob).sum(
-                axis=2
-            )  # future values of tumor and oar state
-            value_interpolation = RegularGridInterpolator(
-                (BEDT, BEDNT), future_values_prob
-            )  # interpolation function
+                actual_policy = best_action
+        elif frac_state == number_of_fractions:
+            sf_squared = sf**2
             for tumor_index, tumor_value in enumerate(BEDT):
+                best_action_tumor = (
+                    -1 + np.sqrt(1 + 4 * (bound_tumor - tumor_value) / abt)
+                ) * abt / 2  # the tumor dose does not depend on the sparing factor
                 for OAR_index, OAR_value in enumerate(
                     BEDNT
                 ):  # this and the next for loop allow us to loop through all states
-                    future_OAR = OAR_dose + OAR_value
-                    overdosing = (future_OAR - bound_OAR).clip(min=0)
-                    future_OAR[
-                        future_OAR > bound_OAR
-                    ] = upperbound_normal_tissue  # any dose surpassing 90.1 is set to 90.1
-                    future_tumor = tumor_value + tumor_dose
-                    future_tumor[
-                        future_tumor > bound_tumor
-                    ] = upperbound_tumor  # any dose surpassing the tumor bound is set to tumor_bound + 0.1
-
-                    if (
-                        frac_state == number_of_fractions
-                    ):  # last state no more further values to add
-                        best_action_BED = (
+                    # last state no more further values to add
+                    best_action_BED = (
+                        (
                             -sf
                             + np.sqrt(
-                                sf**2 + 4 * sf**2 * (bound_OAR - OAR_value) / abn
-                            )
-                        ) / (
-                            2 * sf**2 / abn
-                        )  # calculate maximal dose that can be delivered to OAR and tumor
-                        best_action_tumor = (
-                            -np.ones(len(sf))
-                            + np.sqrt(
-                                np.ones(len(sf))
-                                + 4
-                                * np.ones(len(sf))
-                                * (bound_tumor - tumor_value)
-                                / abt
-                            )
-                        ) / (2 * np.ones(len(sf)) ** 2 / abt)
-                        best_action = np.min(
-                            [best_action_BED, best_action_tumor], axis=0
-                        )  # take the smaller of both doses to not surpass the limit
-                        best_action[best_action > max_dose] = max_dose
-                        best_action[best_action < min_dose] = min_dose
-                        if (
-                            OAR_value > bound_OAR or tumor_value > bound_tumor
-                        ):  # if the limit is already surpassed we add a penaltsy
-                            best_action = np.ones(best_action.shape) * min_dose
-                        future_OAR = OAR_value + BED_calc0(best_action, abn, sf)
-                        future_tumor = tumor_value + BED_calc0(best_action, abt, 1)
-                        overdose_penalty2 = np.zeros(
-                            best_action.shape
-                        )  # we need a second penalty if we overdose in the last fraction
-                        overdose_penalty3 = np.zeros(best_action.shape)
-                        overdose_penalty2[
-                            future_tumor > bound_tumor + 0.0001
-                        ] = -100000000000
-                        overdose_penalty3[
-                            future_OAR > bound_OAR + 0.0001
-                        ] = (
-                            -100000000000
-                        )  # A small number has to be added as sometimes 90. > 90 was True
-                        end_penalty = (
-                            -abs(future_tumor - bound_tumor) * underdosepenalty
-                        )  # the farther we are away from the prescribed dose, the higher the penalty. Under- and overdosing is punished
-                        end_penalty_OAR = (
-                            -(future_OAR - bound_OAR).clip(min=0) * 1000
-                        )  # if overdosing the OAR is not preventable, the overdosing should stay as low as possible
-                        Values[index][tumor_index][OAR_index] = (
-                            end_penalty
-                            - BED_calc0(best_action, abn, sf)
-                            + overdose_penalty2
-                            + overdose_penalty3
-                            + end_penalty_OAR
-                        )  # we also substract all the dose delivered to the OAR so the algorithm tries to minimize it
-                        policy[index][tumor_index][OAR_index] = best_action * 10
-                    else:
-                        future_value = np.zeros([len(sf), len(actionspace)])
-                        for actual_sf in range(0, len(sf)):
-                            future_value[actual_sf] = value_interpolation(
-                                np.array([future_tumor, future_OAR[actual_sf]]).T
+                                sf_squared * (1 + 4 * (bound_OAR - OAR_value) / abn)
                             )
-                        penalties = (
-                            overdosing * -10000000000
-                        )  # additional penalty when overdosing is needed when choosing a minimum dose to be delivered
-                        Vs = future_value - OAR_dose + penalties
-                        best_action = Vs.argmax(axis=1)
-                        valer = Vs.max(axis=1)
-                        policy[index][tumor_index][OAR_index] = best_action
-                        Values[index][tumor_index][OAR_index] = valer
-    if fraction != number_of_fractions:
-        physical_dose = actionspace[actual_policy]
-    else:
-        physical_dose = actual_policy / 10
+                        )
+                        * abn
+                        / (2 * sf_squared)
+                    )  # calculate maximal dose that can be delivered to OAR and tumor
+                    best_action = np.minimum(
+                        best_action_BED, best_action_tumor
+                    )  # take the smaller of both doses to not surpass the limit
+                    best_action[best_action > max_dose] = max_dose
+                    best_action[best_action < min_dose] = min_dose
+                    if (
+                        OAR_value > bound_OAR or tumor_value > bound_tumor
+                    ):  # if the limit is already surpassed we add a penaltsy
+                        best_action = np.ones(best_action.shape) * min_dose
+                    future_OAR = OAR_value + BED_calc0(best_action, abn, sf)
+                    future_tumor = tumor_value + BED_calc0(best_action, abt, 1)
+                    overdose_penalty2 = np.zeros(
+                        best_action.shape
+                    )  # we need a second penalty if we overdose in the last fraction
+                    overdose_penalty3 = np.zeros(best_action.shape)
+                    overdose_penalty2[
+                        future_tumor > bound_tumor + 0.0001
+                    ] = -100000000000
+                    overdose_penalty3[
+                        future_OAR > bound_OAR + 0.0001
+                    ] = (
+                        -100000000000
+                    )  # A small number has to be added as sometimes 90. > 90 was True
+                    end_penalty = (
+                        -abs(future_tumor - bound_tumor) * underdosepenalty
+                    )  # the farther we are away from the prescribed dose, the higher the penalty. Under- and overdosing is punished
+                    end_penalty_OAR = (
+                        -(future_OAR - bound_OAR).clip(min=0) * 1000
+                    )  # if overdosing the OAR is not preventable, the overdosing should stay as low as possible
+                    Values[index][tumor_index][OAR_index] = (
+                        end_penalty
+                        - BED_calc0(best_action, abn, sf)
+                        + overdose_penalty2
+                        + overdose_penalty3
+                        + end_penalty_OAR
+                    )  # we also substract all the dose delivered to the OAR so the algorithm tries to minimize it
+                    policy[index][tumor_index][OAR_index] = best_action
+        else:
+            Values[index], policy[index] = _backward_step(
+                Values[index - 1],
+                prob,
+                BEDT,
+                BEDNT,
+                actionspace,
+                OAR_dose,
+                tumor_dose,
+                bound_OAR,
+                bound_tumor,
+                upperbound_tumor,
+                upperbound_normal_tissue,
+            )
+    physical_dose = actual_policy
     tumor_dose = BED_calc0(physical_dose, abt)
     OAR_dose = BED_calc0(physical_dose, abn, sparing_factors[-1])
-    accumulated_tumor_dose = BED_calc0(physical_dose, abt) + BED_tumor
-    accumulated_OAR_dose = BED_calc0(physical_dose, abn, sparing_factors[-1]) + BED_OAR
+    accumulated_tumor_dose = tumor_dose + BED_tumor
+    accumulated_OAR_dose = OAR_dose + BED_OAR
     return [
         physical_dose,
         accumulated_tumor_dose,
@@ -538,6 +814,12 @@ def whole_plan(
     OAR_doses = np.zeros(number_of_fractions)
     accumulated_OAR_dose = 0
     accumulated_tumor_dose = 0
+    # the slices are views and the mean and variance of the observed
+    # sparing factors are derived from prefix sums for every fraction
+    sparing_factors = np.asarray(sparing_factors, dtype=float)
+    observed = np.arange(1, len(sparing_factors) + 1)
+    sf_means = np.cumsum(sparing_factors) / observed
+    sf_variances = np.maximum(np.cumsum(sparing_factors**2) / observed - sf_means**2, 0)
     for looper in range(0, number_of_fractions):
         [
             actual_policy,
@@ -562,6 +844,8 @@ def whole_plan(
             fixed_prob,
             fixed_mean,
             std_fixed,
+            sf_mean=sf_means[looper + 1],
+            sf_variance=sf_variances[looper + 1],
         )
         physical_doses[looper] = actual_policy
         tumor_doses[looper] = tumor_dose
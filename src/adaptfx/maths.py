@@ -208,6 +208,62 @@ def interpolate(x, x_pred, y_reg):
     y = np.interp(x, x_pred, y_reg)
     return y
 
+def interpolate_uniform(x, x_pred, y_reg):
+    """
+    calculates y values from interpolated function y(x)
+    for uniformly spaced x predictors. The interval of each x
+    is found by subtract and floor,
+    x outside of x_pred is clamped as in np.interp
+
+    Parameters
+    ----------
+    x : array
+        x values for interpolated function
+    x_pred : array
+        uniformly spaced ascending x predictor for interpolation
+    y_reg : array
+        y regressand predictors of interpolation
+
+    Returns
+    -------
+    y : array
+        interpolated values, same shape as x
+
+    """
+    n_pred = len(x_pred)
+    if n_pred == 1:
+        return np.full(np.shape(x), y_reg[0], dtype=float)
+    stepsize = (x_pred[-1] - x_pred[0]) / (n_pred - 1)
+    position = np.clip((x - x_pred[0]) / stepsize, 0, n_pred - 1)
+    index = np.minimum(position.astype(np.intp), n_pred - 2)
+    weight = position - index
+    y = y_reg[index] * (1 - weight) + y_reg[index + 1] * weight
+    return y
+
+def argmax_max(a, axis):
+    """
+    finds the index and the value of the maximum along an axis.
+    the maximum is gathered from a at the argmax index
+
+    Parameters
+    ----------
+    a : array
+        array to reduce
+    axis : int
+        axis along which the maximum is searched
+
+    Returns
+    -------
+    index : array
+        index of the maximum, a with axis removed
+    maximum : array
+        maximum values, a with axis removed
+
+    """
+    index = a.argmax(axis=axis)
+    maximum = np.take_along_axis(a, np.expand_dims(index, axis), axis)
+    return index, maximum.squeeze(axis)
+
 def find_exponent(number):
     """
     find exponent of number in order of ten
@@ -1,7 +1,12 @@
 # -*- coding: utf-8 -*-
+import os
+import hashlib
 import numpy as np
 import adaptfx as afx
 import scipy.optimize as opt
+from contextlib import nullcontext
+from functools import partial
+from multiprocessing import Pool
 
 def bed_calc0(dose, ab, sf=1):
     """
@@ -23,7 +28,8 @@ def bed_calc0(dose, ab, sf=1):
         and alpha-beta ratio.
 
     """
-    BED = sf * dose * (1 + (sf * dose) / ab)
+    sf_dose = sf * dose
+    BED = sf_dose * (1 + sf_dose / ab)
     return BED
 
 
@@ -47,9 +53,9 @@ def bed_calc_matrix(actionspace, ab, sf):
         and sparing factors.
 
     """
-    BED = np.outer(actionspace, sf) * (
-        1 + np.outer(actionspace, sf) / ab
-    )  # produces a actions space x sparing factor array
+    # produces a actions space x sparing factor array
+    dose_sf = np.outer(actionspace, sf)
+    BED = dose_sf * (1 + dose_sf / ab)
     return BED
 
 def convert_to_physical(bed, ab, sf=1):
@@ -70,18 +76,72 @@ def convert_to_physical(bed, ab, sf=1):
     dose : positive values float/array
         physical dose
     """
-    bed_array = np.array(bed)
-    bed_array[bed_array < 0] = 0
+    # negative BED are clipped to zero
+    bed_array = np.maximum(bed, 0)
     physical_dose = (-sf + np.sqrt(sf**2 + 4 * sf**2 * bed_array / ab)) / (
         2 * sf**2 / ab)
     return physical_dose
 
-def cost_func(keys, n_list, n_samples):
+def _aft_oar_sum(para):
+    """
+    cumulative OAR BED of an adaptive fractionation plan,
+    module level such that it can be sent to worker processes
+
+    Parameters
+    ----------
+    para : dict
+        algorithm instructions of one sampled patient.
+
+    Returns
+    -------
+    oar_sum : float
+        cumulative OAR BED
+    """
+    return afx.multiple('oar', para).oar_sum
+
+def _cost_cache_file(keys, n_list, n_samples, cache_dir):
+    """
+    filename under which the cost_func results are stored,
+    the name is a hash of the parameters the simulation depends on
+
+    Parameters
+    ----------
+    keys : dict
+        algorithm instructions.
+    n_list : array
+        array of maximum number of fractions
+    n_samples : int
+        number of patients to sample
+    cache_dir : string
+        directory of the stored results
+
+    Returns
+    -------
+    cache_file : string
+        path to the stored results
+    """
+    # the sparing factors and the number of fractions are overwritten for
+    # every sampled patient, the public sparing factors are rebuilt by multiple
+    ignored = ('sparing_factors', 'sparing_factors_public',
+        'number_of_fractions')
+    para = sorted((key, repr(value)) for key, value in keys.items()
+        if key not in ignored)
+    key = repr((para, [int(n) for n in n_list], int(n_samples)))
+    key_hash = hashlib.sha1(key.encode()).hexdigest()[:16]
+    cache_file = os.path.join(cache_dir, f'cost_{key_hash}.npz')
+    return cache_file
+
+def cost_func(keys, n_list, n_samples, cache_dir=None, processes=None):
     """
     For a specified list of maximum number of fractions
     simulates average cumulative OAR BED for uniform-,
     adaptive- and optimal-fractionation (theoretical optimum)
 
+    With more than one process the adaptive fractionation plans are
+    calculated in a multiprocessing pool, the calling script then has
+    to be protected by an if __name__ == '__main__': guard on platforms
+    using the spawn start method (Windows, macOS)
+
     Parameters
     ----------
     keys : dict
@@ -90,6 +150,12 @@ def cost_func(keys, n_list, n_samples):
         array of maximum number of fractions
     n_samples : int
         number of patients to sample
+    cache_dir : string, optional
+        directory in which the results are stored and looked up
+        for the same instructions, the default is None (no storing)
+    processes : int, optional
+        number of worker processes for the adaptive fractionation,
+        the default is None (serial calculation without a pool)
 
     Returns
     -------
@@ -100,37 +166,90 @@ def cost_func(keys, n_list, n_samples):
     opt : array
         optimal fractionated average cumulative BED
     """
-    para = keys
-    BED_matrix = np.zeros((3,len(n_list), n_samples))
-    for i, n_max in enumerate(n_list):
-        dose = keys.abt/(2*n_max) * (np.sqrt(n_max ** 2 + 4*n_max*keys.tumor_goal/keys.abt) - n_max)
-        para.number_of_fractions = n_max
-        for j in range(n_samples):
-            sf_list = np.random.normal(para.fixed_mean, para.fixed_std, n_max+1)
-            para.sparing_factors = sf_list
-            # calculate uniform fractionation
-            BED_matrix[0][i][j] = np.sum(bed_calc0(dose, para.abn, sf_list[1:]))
-            # calculate adaptive fractionation
-            BED_matrix[1][i][j] = afx.multiple('oar', para).oar_sum
+    if cache_dir is not None:
+        cache_file = _cost_cache_file(keys, n_list, n_samples, cache_dir)
+        if os.path.isfile(cache_file):
+            with np.load(cache_file) as stored:
+                BED_uft, BED_aft, BED_opt = stored['bed']
+            return BED_uft, BED_aft, BED_opt
+
+    # the simulated BED are stored in single precision, far below the
+    # Monte Carlo noise, the means are accumulated in double precision
+    BED_matrix = np.empty((3, len(n_list), n_samples), dtype=np.float32)
+    # sample the sparing factors of all patients for all number
+    # of fractions at once, dim(sf_all)=(n_list,n_samples,max(n_list)+1)
+    sf_all = np.random.normal(keys.fixed_mean, keys.fixed_std,
+        (len(n_list), n_samples, np.max(n_list) + 1))
+    # uniform physical dose reaching the tumor goal for every number of fractions
+    n_list = np.asarray(n_list)
+    doses = keys.abt/(2*n_list) * (np.sqrt(n_list ** 2 + 4*n_list*keys.tumor_goal/keys.abt) - n_list)
+
+    # calculate uniform fractionation for all patients and number of fractions,
+    # the sum over sf * dose * (1 + sf * dose / abn) is split into the sums of sf
+    # and sf**2, the mask selects the fractions 1 to n_max of every sample
+    columns = np.arange(sf_all.shape[2])
+    fraction_mask = (columns >= 1) & (columns <= n_list.reshape(-1, 1))
+    sf_fractions = sf_all * fraction_mask.reshape(len(n_list), 1, -1)
+    sf_sum = sf_fractions.sum(axis=2)
+    sf_square_sum = np.einsum('lsn,lsn->ls', sf_fractions, sf_fractions)
+    doses_reshaped = doses.reshape(-1, 1)
+    BED_matrix[0] = doses_reshaped * sf_sum + doses_reshaped**2 / keys.abn * sf_square_sum
+
+    def bed_calc_d(dose, sf_list):
+        cum_bed = afx.bed_calc0(dose, keys.abn, sf_list)
+        return np.sum(cum_bed)
+
+    def d_bed_calc_d(dose, sf_list):
+        # analytic gradient of bed_calc_d
+        return sf_list + 2 * sf_list**2 * dose / keys.abn
+    # define tumor BED constraint and its gradient
+    cons = [{'type': 'eq', 'fun': lambda x: np.sum(afx.bed_calc0(x, keys.abt)) - keys.tumor_goal,
+        'jac': lambda x: 1 + 2 * x / keys.abt}]
+
+    # the adaptive fractionation plans are independent and calculated in
+    # parallel worker processes, a pool is only started if every process
+    # gets at least two patients, otherwise they are calculated serially
+    parallel = processes is not None and 1 < processes <= n_samples // 2
+    with Pool(processes) if parallel else nullcontext() as pool:
+        if parallel:
+            chunksize = max(1, n_samples // (4 * processes))
+            aft_map = partial(pool.map, chunksize=chunksize)
+        else:
+            aft_map = map
+        for i, (n_max, dose) in enumerate(zip(n_list, doses)):
+            # dim(sf_samples)=(n_samples,n_max+1)
+            sf_samples = sf_all[i, :, :n_max+1]
+            # calculate adaptive fractionation, every patient gets its own
+            # instructions with its number of fractions and sparing factors,
+            # the instructions of the caller are left untouched
+            aft_tasks = [afx.DotDict({**keys, 'number_of_fractions': n_max,
+                'sparing_factors': sf_list}) for sf_list in sf_samples]
+            BED_matrix[1][i] = list(aft_map(_aft_oar_sum, aft_tasks))
             # calculate optimal fractionation if all sparing factors are known at the beginning
-            def bed_calc_d(dose):
-                cum_bed = afx.bed_calc0(dose, para.abn, sf_list[1:])
-                return np.sum(cum_bed)
             d_in = dose * np.ones(n_max)
-            # define tumor BED constraint
-            cons = [{'type': 'eq', 'fun': lambda x: np.sum(afx.bed_calc0(x, para.abt)) - para.tumor_goal}]
-            BED_matrix[2][i][j] = opt.minimize(bed_calc_d, x0=d_in, constraints=cons).fun
+            for j, sf_list in enumerate(sf_samples):
+                BED_matrix[2][i][j] = opt.minimize(bed_calc_d, x0=d_in, args=(sf_list[1:],),
+                    jac=d_bed_calc_d, constraints=cons).fun
+
+    BED_means = np.mean(BED_matrix, axis=2, dtype=np.float64)
+    BED_uft, BED_aft, BED_opt = BED_means[0], BED_means[1], BED_means[2]
 
-        BED_means = np.mean(BED_matrix, axis=2)
-        BED_uft, BED_aft, BED_opt = BED_means[0], BED_means[1], BED_means[2]
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        np.savez_compressed(cache_file, bed=BED_means)
     return BED_uft, BED_aft, BED_opt
 
 
-def c_calc(keys, n_target, n_samples, plot=False):
+def c_calc(keys, n_target, n_samples, plot=False, cache_dir=None,
+        processes=None):
     """
     For a specified targeted number of fractions
     gives the optimal C, when minimising OAR BED 
 
+    With more than one process the calling script has to be protected
+    by an if __name__ == '__main__': guard on platforms using the
+    spawn start method (Windows, macOS), see cost_func
+
     Parameters
     ----------
     keys : dict
@@ -139,13 +258,30 @@ def c_calc(keys, n_target, n_samples, plot=False):
     n_target : int
         targeted number of fractions
 
+    n_samples : int
+        number of patients to sample
+
+    plot : bool, optional
+        plot the simulated BED and the fit, the default is False
+
+    cache_dir : string, optional
+        directory for storing the simulated BED, see cost_func
+
+    processes : int, optional
+        number of worker processes for the simulation, see cost_func
+
     Returns
     -------
     c : positive float
         optimal parameter for achieving n_pres fractions.
     """
     n_upper = keys.number_of_fractions
+    if n_upper <= n_target:
+        # the target is reached without penalising fractions
+        return 0
+
     n_list = np.arange(1, n_upper + 3)
+    curvature = 4 * keys.tumor_goal / keys.abt
 
     def cost_fit_func(n_list, a, b):
         """
@@ -154,15 +290,17 @@ def c_calc(keys, n_target, n_samples, plot=False):
 
         Parameters
         ----------
+        n_list : array
+            number of fractions.
         a, b : float
             fit parameter.
 
         Returns
         -------
-        cost : positive float
-            total OAR BED
+        cost : array
+            total OAR BED, same shape as n_list
         """
-        curvature = 4 * keys.tumor_goal / keys.abt
+        n_list = np.asarray(n_list)
         cost = a * (n_list - np.sqrt(n_list**2 + curvature * n_list)) + b
         return cost
     
@@ -170,20 +308,21 @@ def c_calc(keys, n_target, n_samples, plot=False):
         """
         Negative derivative of cost_fit_func at n_target
         """
-        curvature = 4 * keys.tumor_goal / keys.abt
         d_cost_fit_func = a - (a*curvature + 2 * a * n_target)/(2*np.sqrt(n_target * (curvature + n_target)))
         return -d_cost_fit_func
     
-    if n_upper <= n_target:
-        c_opt = 0
-    else:
-        y_no, y_aft, y_opt = cost_func(keys, n_list, n_samples)
-        [a_opt, b_opt], _ = opt.curve_fit(cost_fit_func, n_list, y_aft)
-        c_opt = d_cost_fit_func(a_opt, n_target)
+    y_no, y_aft, y_opt = cost_func(keys, n_list, n_samples, cache_dir,
+        processes)
+    # cost_fit_func is linear in a and b, the least squares
+    # fit is solved with the design matrix of both terms
+    design = np.column_stack((cost_fit_func(n_list, 1, 0), np.ones(len(n_list))))
+    fit_params, *_ = np.linalg.lstsq(design, y_aft, rcond=None)
+    c_opt = d_cost_fit_func(fit_params[0], n_target)
 
     if plot:
+        # the design matrix evaluates the fitted cost_fit_func
         bed_results = {'uniform':y_no, 'adaptive':y_aft, 'optimal':y_opt,
-                       'aft_fit':cost_fit_func(n_list, a_opt, b_opt)}
+                       'aft_fit':design @ fit_params}
         fig = afx.plot_accumulated_bed(n_list, bed_results)
 
     return c_opt
@@ -84,11 +84,13 @@ def min_n_frac(keys, sets=afx.SETTING_DICT):
     # actionspace in bed dose
     bedt_space = np.linspace(0, remaining_bed, n_bedsteps + 1)
     actionspace = afx.convert_to_physical(bedt_space, abt)
-    range_action = (actionspace >= min_dose) & (actionspace <= max_dose)
+    # the ascending actionspace is restricted to [min_dose, max_dose] by bisection
+    range_action = slice(np.searchsorted(actionspace, min_dose, 'left'),
+        np.searchsorted(actionspace, max_dose, 'right'))
     actionspace = actionspace[range_action]
     # bed_space to relate actionspace to oar- and tumor-dose
     bedt_space = bedt_space[range_action]
-    if not range_action.any():
+    if len(actionspace) == 0:
         # check if actionspace is empty
         bedt_space = np.array([min_dose])
         actionspace = afx.convert_to_physical(bedt_space, abt)
@@ -105,8 +107,9 @@ def min_n_frac(keys, sets=afx.SETTING_DICT):
     n_bedt_states = len(bedt_states)
     
     # relate actionspace to bed and possible sparing factors
-    # necessary reshape for broadcasting in value calculation
-    bedn_sf_space = afx.bed_calc_matrix(actionspace, abn, sf).reshape(1, n_action, n_sf)
+    # necessary reshape for broadcasting in value calculation,
+    # the actionspace is the last axis such that the reductions are contiguous
+    bedn_sf_space = afx.bed_calc_matrix(actionspace, abn, sf).T.reshape(1, n_sf, n_action)
     # values matrix
     # dim(values) = dim(policy) = fractions_remaining * bedt * sf
     n_remaining_fractions = number_of_fractions - fraction
@@ -130,9 +133,9 @@ def min_n_frac(keys, sets=afx.SETTING_DICT):
             # state is the actual fraction to calculate
             # e.g. in the first fraction_state there is no prior dose delivered
             # and future_bedt is equal to bedt_space
-            future_values_discrete = (values[fraction_index + 1] * prob).sum(axis=1)
+            future_values_discrete = np.einsum('ns,s->n', values[fraction_index + 1], prob)
             future_bedt = accumulated_tumor_dose + bedt_space
-            future_bedt = np.where(future_bedt > tumor_goal, tumor_limit, future_bedt)
+            np.minimum(future_bedt, tumor_limit, out=future_bedt)
             c_penalties = np.where(np.round(future_bedt, -exp) < tumor_goal, -c, 0)
             future_values = afx.interpolate(future_bedt, bedt_states, future_values_discrete)
             vs = -bedn_space + future_values + c_penalties
@@ -142,21 +145,23 @@ def min_n_frac(keys, sets=afx.SETTING_DICT):
             if policy_plot or values_plot or remains_plot:
                 # for the policy plot
                 future_bedt_full = bedt_states.reshape(n_bedt_states, 1) + bedt_space
-                future_bedt_full = np.where(future_bedt_full > tumor_goal, tumor_limit, future_bedt_full)
-                c_penalties_full = np.where(future_bedt_full < tumor_goal, -c, 0).reshape(n_bedt_states, n_action, 1)
-                future_values_full = afx.interpolate(future_bedt_full, bedt_states, future_values_discrete)
-                vs_full = -bedn_sf_space + future_values_full.reshape(n_bedt_states, n_action, 1) + c_penalties_full
-                # check vs along the sf axis
-                current_policy = bedt_space[vs_full.argmax(axis=1)]
+                np.minimum(future_bedt_full, tumor_limit, out=future_bedt_full)
+                c_penalties_full = np.where(future_bedt_full < tumor_goal, -c, 0).reshape(n_bedt_states, 1, n_action)
+                future_values_full = afx.interpolate_uniform(future_bedt_full, bedt_states, future_values_discrete)
+                vs_full = future_values_full.reshape(n_bedt_states, 1, n_action) - bedn_sf_space
+                vs_full += c_penalties_full
+                # check vs along the action axis for every sf
+                policy_index, values_full = afx.argmax_max(vs_full, axis=2)
+                current_policy = bedt_space[policy_index]
                 # ensure that for the goal reached the value/policy is zero (min_dose)
                 current_policy[bedt_states == tumor_goal] = 0
-                future_remains_discrete = (remains[fraction_index + 1] * prob).sum(axis=1)
+                future_remains_discrete = np.einsum('ns,s->n', remains[fraction_index + 1], prob)
                 future_bedt_opt = current_policy + bedt_states.reshape(n_bedt_states, 1)
-                future_remains = afx.interpolate(future_bedt_opt, bedt_states, future_remains_discrete)
+                future_remains = afx.interpolate_uniform(future_bedt_opt, bedt_states, future_remains_discrete)
                 current_remains = np.where((current_policy - remaining_states[::-1].reshape(n_bedt_states, 1)) >= 0, 0, 1)
                 # write to arrays
                 policy[fraction_index] = current_policy
-                values[fraction_index] = vs_full.max(axis=1)
+                values[fraction_index] = values_full
                 remains[fraction_index] = current_remains + future_remains
 
         elif fraction == number_of_fractions:
@@ -198,27 +203,28 @@ def min_n_frac(keys, sets=afx.SETTING_DICT):
         elif fraction_state != number_of_fractions:
             # every other state but the last
             # this calculates the value function in the future fractions
-            future_values_discrete = (values[fraction_index + 1] * prob).sum(axis=1)
+            future_values_discrete = np.einsum('ns,s->n', values[fraction_index + 1], prob)
             # bedt_states is reshaped such that numpy broadcast leads to 2D array
             future_bedt = bedt_states.reshape(n_bedt_states, 1) + bedt_space
-            future_bedt = np.where(future_bedt > tumor_goal, tumor_limit, future_bedt)
-            future_values = afx.interpolate(future_bedt, bedt_states, future_values_discrete)
-            c_penalties = np.where(future_bedt < tumor_goal, -c, 0).reshape(n_bedt_states, n_action, 1)
-            # dim(bedn_sf_space)=(1,n_action,n_sf),dim(future_values)=(n_states,n_action)
-            # every row of values_penalties is transposed and copied n_sf times
-            vs = -bedn_sf_space + future_values.reshape(n_bedt_states, n_action, 1) + c_penalties
-            # check vs along the sf axis
-            values[fraction_index] = vs.max(axis=1)
+            np.minimum(future_bedt, tumor_limit, out=future_bedt)
+            future_values = afx.interpolate_uniform(future_bedt, bedt_states, future_values_discrete)
+            c_penalties = np.where(future_bedt < tumor_goal, -c, 0).reshape(n_bedt_states, 1, n_action)
+            # dim(bedn_sf_space)=(1,n_sf,n_action),dim(future_values)=(n_states,n_action)
+            # every row of values_penalties is copied n_sf times
+            vs = future_values.reshape(n_bedt_states, 1, n_action) - bedn_sf_space
+            vs += c_penalties
+            # check vs along the action axis for every sf
+            policy_index, values[fraction_index] = afx.argmax_max(vs, axis=2)
             # ensure that for the goal reached the value/policy is zero (min_dose)
             values[fraction_index][bedt_states==tumor_goal] = 0
 
             if policy_plot or remains_plot:
-                current_policy = bedt_space[vs.argmax(axis=1)]
+                current_policy = bedt_space[policy_index]
                 # ensure that for the goal reached the value/policy is zero (min_dose)
                 current_policy[bedt_states == tumor_goal] = 0
-                future_remains_discrete = (remains[fraction_index + 1] * prob).sum(axis=1)
+                future_remains_discrete = np.einsum('ns,s->n', remains[fraction_index + 1], prob)
                 future_bedt_opt = current_policy + bedt_states.reshape(n_bedt_states, 1)
-                future_remains = afx.interpolate(future_bedt_opt, bedt_states, future_remains_discrete)
+                future_remains = afx.interpolate_uniform(future_bedt_opt, bedt_states, future_remains_discrete)
                 current_remains = np.where((current_policy - remaining_states[::-1].reshape(n_bedt_states, 1)) >= 0, 0, 1)
                 # write to arrays
                 policy[fraction_index] = current_policy
@@ -326,19 +332,22 @@ def max_tumor_bed(keys, sets=afx.SETTING_DICT):
     bedn_space_pre = np.linspace(0, remaining_bed, n_bedsteps + 1)
     actionspace_pre = afx.convert_to_physical(bedn_space_pre, abn, actual_sf)
     bedt_space_pre = afx.bed_calc0(actionspace_pre, abt)
-    range_action = (bedn_space_pre >= min_dose) & (bedn_space_pre <= max_dose)
-    if range_action.any():
+    # the ascending bed space is restricted to [min_dose, max_dose] by bisection
+    range_action = slice(np.searchsorted(bedn_space_pre, min_dose, 'left'),
+        np.searchsorted(bedn_space_pre, max_dose, 'right'))
+    if range_action.start < range_action.stop:
         # check if actionspace is empty
         bedn_space = bedn_space_pre[range_action]
         actionspace = actionspace_pre[range_action]
         bedt_space = bedt_space_pre[range_action]
         n_action = len(bedn_space)
-        bedn_space_sf = np.zeros((1, n_sf)) + bedn_space.reshape(n_action, 1)
+        bedn_space_sf = np.zeros((n_sf, 1)) + bedn_space
         # bed_space to relate actionspace to oar- and tumor-dose
-        actionspace_sf = afx.convert_to_physical(bedn_space.reshape(n_action, 1), abn, sf)
+        # dim(actionspace_sf)=(n_sf,n_action) such that the reductions are contiguous
+        actionspace_sf = afx.convert_to_physical(bedn_space, abn, sf.reshape(n_sf, 1))
     else:
-        bedn_space_sf = np.zeros((1, n_sf)) + np.array([min_dose])
-        actionspace_sf = afx.convert_to_physical(bedn_space_sf, abn, sf)
+        bedn_space_sf = np.zeros((n_sf, 1)) + np.array([min_dose])
+        actionspace_sf = afx.convert_to_physical(bedn_space_sf, abn, sf.reshape(n_sf, 1))
         n_action = 1
     bedt_space_sf = afx.bed_calc0(actionspace_sf, abt)
 
@@ -374,9 +383,9 @@ def max_tumor_bed(keys, sets=afx.SETTING_DICT):
             # state is the actual fraction to calculate
             # e.g. in the first fraction_state there is no prior dose delivered
             # and future_bedt is equal to bedt_space
-            future_values_discrete = (values[fraction_index + 1] * prob).sum(axis=1)
+            future_values_discrete = np.einsum('ns,s->n', values[fraction_index + 1], prob)
             future_bedn = accumulated_oar_dose + bedn_space
-            future_bedn = np.where(future_bedn > oar_limit, oar_upper_bound, future_bedn)
+            np.minimum(future_bedn, oar_upper_bound, out=future_bedn)
             c_penalties = np.where(np.round(future_bedn, -exp) < oar_limit, -c, 0)
             future_values = afx.interpolate(future_bedn, bedn_states, future_values_discrete)
             vs = bedt_space + future_values + c_penalties
@@ -385,22 +394,24 @@ def max_tumor_bed(keys, sets=afx.SETTING_DICT):
 
             if policy_plot or values_plot or remains_plot:
                 # for the policy plot
-                future_bedn_full = bedn_states.reshape(n_bedn_states, 1, 1) + bedn_space_sf.reshape(1, n_action, n_sf)
-                future_bedn_full = np.where(future_bedn_full > oar_limit, oar_upper_bound, future_bedn_full)
+                future_bedn_full = bedn_states.reshape(n_bedn_states, 1, 1) + bedn_space_sf.reshape(1, n_sf, n_action)
+                np.minimum(future_bedn_full, oar_upper_bound, out=future_bedn_full)
                 c_penalties_full = np.where(future_bedn_full < oar_limit, -c, 0)
-                future_values_full = afx.interpolate(future_bedn_full, bedn_states, future_values_discrete)
-                vs_full = bedt_space_sf.reshape(1, n_action, n_sf) + future_values_full + c_penalties_full
-                # check vs along the sf axis
-                current_policy = bedn_space[vs_full.argmax(axis=1)]
+                future_values_full = afx.interpolate_uniform(future_bedn_full, bedn_states, future_values_discrete)
+                vs_full = future_values_full + bedt_space_sf.reshape(1, n_sf, n_action)
+                vs_full += c_penalties_full
+                # check vs along the action axis for every sf
+                policy_index, values_full = afx.argmax_max(vs_full, axis=2)
+                current_policy = bedn_space[policy_index]
                 # ensure that for the goal reached the value/policy is zero (min_dose)
                 current_policy[bedn_states == oar_limit] = 0
-                future_remains_discrete = (remains[fraction_index + 1] * prob).sum(axis=1)
+                future_remains_discrete = np.einsum('ns,s->n', remains[fraction_index + 1], prob)
                 future_bedn_opt = current_policy + bedn_states.reshape(n_bedn_states, 1)
-                future_remains = afx.interpolate(future_bedn_opt, bedn_states, future_remains_discrete)
+                future_remains = afx.interpolate_uniform(future_bedn_opt, bedn_states, future_remains_discrete)
                 current_remains = np.where((current_policy - remaining_states[::-1].reshape(n_bedn_states, 1)) >= 0, 0, 1)
                 # write to arrays
                 policy[fraction_index] = current_policy
-                values[fraction_index] = vs_full.max(axis=1)
+                values[fraction_index] = values_full
                 remains[fraction_index] = current_remains + future_remains
 
         elif fraction == number_of_fractions:
@@ -417,8 +428,7 @@ def max_tumor_bed(keys, sets=afx.SETTING_DICT):
             # dose remaining to be delivered, this is the actionspace in bedt
             last_bed_actions = np.round(oar_limit - bedn_states, -exp)
             # cut the actionspace to min and max dose constraints
-            last_bed_actions = np.where(last_bed_actions < min_dose, min_dose, last_bed_actions)
-            last_bed_actions = np.where(last_bed_actions > max_dose, max_dose, last_bed_actions)
+            last_bed_actions = np.clip(last_bed_actions, min_dose, max_dose)
             last_bed_actions_reshaped = last_bed_actions.reshape(n_bedn_states, 1)
             last_actions = afx.convert_to_physical(last_bed_actions_reshaped, abn, sf)
             last_bedt = afx.bed_calc0(last_actions, abt)
@@ -441,27 +451,27 @@ def max_tumor_bed(keys, sets=afx.SETTING_DICT):
         elif fraction_state != number_of_fractions:
             # every other state but the last
             # this calculates the value function in the future fractions
-            future_values_discrete = (values[fraction_index + 1] * prob).sum(axis=1)
+            future_values_discrete = np.einsum('ns,s->n', values[fraction_index + 1], prob)
             # bedt_states is reshaped such that numpy broadcast leads to 2D array
-            future_bedn = bedn_states.reshape(n_bedn_states, 1, 1) + bedn_space_sf.reshape(1, n_action, n_sf)
-            future_bedn = np.where(future_bedn > oar_limit, oar_upper_bound, future_bedn)
-            future_values = afx.interpolate(future_bedn, bedn_states, future_values_discrete)
+            future_bedn = bedn_states.reshape(n_bedn_states, 1, 1) + bedn_space_sf.reshape(1, n_sf, n_action)
+            np.minimum(future_bedn, oar_upper_bound, out=future_bedn)
+            future_values = afx.interpolate_uniform(future_bedn, bedn_states, future_values_discrete)
             c_penalties = np.where(future_bedn < oar_limit, -c, 0)
-            # dim(bedn_sf_space)=(1,n_action,n_sf),dim(future_values)=(n_states,n_action)
-            # every row of values_penalties is transposed and copied n_sf times
-            vs = bedt_space_sf.reshape(1, n_action, n_sf) + future_values + c_penalties
-            # check vs along the sf axis
-            values[fraction_index] = vs.max(axis=1)
+            # dim(bedt_space_sf)=(1,n_sf,n_action),dim(future_values)=(n_states,n_sf,n_action)
+            vs = future_values + bedt_space_sf.reshape(1, n_sf, n_action)
+            vs += c_penalties
+            # check vs along the action axis for every sf
+            policy_index, values[fraction_index] = afx.argmax_max(vs, axis=2)
             # ensure that for the goal reached the value/policy is zero (min_dose)
             values[fraction_index][bedn_states==oar_limit] = 0
 
             if policy_plot or remains_plot:
-                current_policy = bedn_space[vs.argmax(axis=1)]
+                current_policy = bedn_space[policy_index]
                 # ensure that for the goal reached the value/policy is zero (min_dose)
                 current_policy[bedn_states == oar_limit] = 0
-                future_remains_discrete = (remains[fraction_index + 1] * prob).sum(axis=1)
+                future_remains_discrete = np.einsum('ns,s->n', remains[fraction_index + 1], prob)
                 future_bedn_opt = current_policy + bedn_states.reshape(n_bedn_states, 1)
-                future_remains = afx.interpolate(future_bedn_opt, bedn_states, future_remains_discrete)
+                future_remains = afx.interpolate_uniform(future_bedn_opt, bedn_states, future_remains_discrete)
                 current_remains = np.where((current_policy - remaining_states[::-1].reshape(n_bedn_states, 1)) >= 0, 0, 1)
                 # write to arrays
                 policy[fraction_index] = current_policy
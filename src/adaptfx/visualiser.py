@@ -1,9 +1,8 @@
 # -*- coding: utf-8 -*-
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.colors import Normalize as normalise
-import matplotlib.cm as cm
 import adaptfx as afx
+# matplotlib is imported in the plotting functions, such that
+# importing adaptfx for calculations does not load it
 
 def plot_val(sfs, states, data, fractions, colmap='turbo'):
     """
@@ -28,6 +27,10 @@ def plot_val(sfs, states, data, fractions, colmap='turbo'):
         matplotlib pyplot figure
 
     """
+    import matplotlib.pyplot as plt
+    from matplotlib.colors import Normalize as normalise
+    import matplotlib.cm as cm
+
     if colmap == 'turbo':
         label = r'Policy $\pi$ in BED$_{10}$ [Gy]'
     elif colmap == 'viridis':
@@ -99,6 +102,8 @@ def plot_accumulated_bed(n_list, bed_dict):
     fig : matplotlib.pyplot.figure
         matplotlib pyplot figure
     """
+    import matplotlib.pyplot as plt
+
     fig, ax = plt.subplots(1, 1)
     for key in bed_dict:
         ax.plot(n_list, bed_dict[key], label=key)
@@ -127,6 +132,8 @@ def plot_probability(sf_list, pdf_list, fractions_list):
     fig : matplotlib.pyplot.figure
         matplotlib pyplot figure
     """
+    import matplotlib.pyplot as plt
+
     fig, ax = plt.subplots(1, 1)
     for i, fraction in enumerate(fractions_list):
         ax.plot(sf_list[i], pdf_list[i], label=rf'$t={fraction}$')
@@ -140,9 +147,11 @@ def plot_probability(sf_list, pdf_list, fractions_list):
 
 
 def show_plot():
+    import matplotlib.pyplot as plt
     plt.show()
 
 def save_plot(basename, *figures):
+    import matplotlib.pyplot as plt
     if len(figures)==1:
         figures[0].savefig(f'{basename}.pdf', format='pdf')
         plt.clf()